@@ -0,0 +1,50 @@
+# ฟังก์ชันช่วยที่ใช้ร่วมกันระหว่าง streamlit_app.py และ streamlit_app_old.py
+import numpy as np
+import pandas as pd
+
+MAX_CHART_POINTS = 5000
+
+def interpolate_linear(values):
+    # เทียบเท่า Series.interpolate(method='linear') แต่ใช้ np.interp บน numpy array โดยตรง
+    values = np.asarray(values, dtype=np.float64)
+    known = ~np.isnan(values)
+    if known.all() or not known.any():
+        return values
+    positions = np.arange(len(values))
+    filled = np.interp(positions, positions[known], values[known])
+    filled[:np.argmax(known)] = np.nan  # ค่าว่างก่อนค่าแรกที่มีข้อมูลจะไม่ถูกเติม เหมือน pandas
+    return filled
+
+def iso_weeks_in_year(year):
+    # ปีที่มี 53 สัปดาห์ตาม ISO คือปีที่ 31 ธ.ค. ตรงกับวันพฤหัสบดี หรือปีก่อนหน้าที่ 31 ธ.ค. ตรงกับวันพุธ
+    def dec31_weekday(y):
+        return (y + y // 4 - y // 100 + y // 400) % 7
+    return 52 + ((dec31_weekday(year) == 4) | (dec31_weekday(year - 1) == 3))
+
+def series_by_datetime(data, column, name):
+    series = pd.Series(data[column].to_numpy(), index=pd.DatetimeIndex(data['datetime']), name=name)
+    return series[~series.index.duplicated()]
+
+def filter_by_datetime(data, start, end):
+    # ข้อมูลที่เรียงตามเวลาแล้ว (เช่นผลจาก read_csv_cached) หาขอบเขตด้วย searchsorted แล้วตัดเป็นช่วงต่อเนื่อง
+    # ไม่ต้องสร้าง mask ทั้งคอลัมน์และคัดลอกทุกแถวที่ผ่านเงื่อนไข ส่วนข้อมูลที่ไม่ได้เรียงยังกรองด้วย mask ตามเดิม
+    start, end = pd.Timestamp(start), pd.Timestamp(end)
+    values = data['datetime'].to_numpy()
+    if values.dtype.kind == 'M':
+        # NaT ถูกเรียงไว้ท้ายสุด จึงตรวจลำดับเฉพาะช่วงค่าที่มีเวลา (ตรวจแบบผ่านครั้งเดียว ถูกกว่าการสร้าง mask)
+        n_valid = len(values) - np.isnat(values).sum()
+        is_sorted = not np.isnat(values[:n_valid]).any() and pd.Index(values[:n_valid]).is_monotonic_increasing
+    else:
+        is_sorted = False  # เช่นเวลาที่มี timezone ซึ่ง numpy เก็บเป็น object
+    if not is_sorted:
+        return data[(data['datetime'] >= start) & (data['datetime'] <= end)]
+    lo = values[:n_valid].searchsorted(start.to_datetime64(), side='left')
+    hi = values[:n_valid].searchsorted(end.to_datetime64(), side='right')
+    return data.iloc[lo:hi]
+
+def downsample_for_chart(data, max_points=MAX_CHART_POINTS):
+    # ข้อมูลช่วงยาวมีจุดหลายหมื่นจุด ลดเหลือค่าเฉลี่ยรายช่วงเวลาไม่เกิน max_points จุด เพื่อลดขนาดข้อมูลที่ส่งให้กราฟ
+    if len(data) <= max_points:
+        return data
+    bucket = ((data.index.max() - data.index.min()) / max_points).ceil('15min')
+    return data.resample(bucket).mean()
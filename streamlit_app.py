@@ -1,12 +1,17 @@
+import io
 import streamlit as st
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
+from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor
 from sklearn.linear_model import LinearRegression
 from sklearn.model_selection import RandomizedSearchCV, train_test_split, TimeSeriesSplit
 import altair as alt
 import plotly.express as px
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from data_utils import downsample_for_chart, filter_by_datetime, interpolate_linear, iso_weeks_in_year, series_by_datetime
+
+# เปิด Copy-on-Write: DataFrame ที่ได้จากการกรอง/คัดลอกแบบตื้นจะคัดลอกข้อมูลจริงเมื่อถูกแก้ไขเท่านั้น
+pd.options.mode.copy_on_write = True
 
 # ฟังก์ชันจากโค้ดแรก (Random Forest)
 def load_data(file):
@@ -16,7 +21,8 @@ def load_data(file):
         return None
     
     try:
-        df = pd.read_csv(file)
+        # อ่านไฟล์ผ่านฟังก์ชันที่แคชไว้ด้วย bytes ของไฟล์ ข้อความแจ้งเตือนจึงยังแสดงได้ทุกครั้งที่ rerun
+        df = read_csv_cached(file.getvalue())
         if df.empty:
             st.error("ไฟล์ CSV ว่างเปล่า กรุณาอัปโหลดไฟล์ที่มีข้อมูล")
             return None
@@ -34,6 +40,49 @@ def load_data(file):
     finally:
         message_placeholder.empty()  # ลบข้อความแจ้งเตือนเมื่อเสร็จสิ้นการโหลดไฟล์
 
+# ระบุชนิดข้อมูลล่วงหน้าแทนการให้ pandas เดาจากทั้งไฟล์ (คอลัมน์ที่ไม่มีในไฟล์จะถูกข้ามไป)
+# ระดับน้ำเก็บเป็น float64: ค่าบันทึกละเอียด 0.01 และ fix_outliers_based_on_neighbors เทียบผลต่างกับ 0.01 พอดี
+# ถ้าใช้ float32 การปัดเศษจะเปลี่ยนว่าแถวไหนถูกมองว่าเป็น outlier
+CSV_DTYPES = {'code': 'category', 'wl_up': 'float64', 'wl_up_prev': 'float64'}
+
+@st.cache_data(show_spinner=False)
+def read_csv_cached(file_bytes):
+    df = read_csv_pyarrow(file_bytes)
+    if df is None:
+        # ไม่มี pyarrow หรือ pyarrow อ่านไฟล์นี้ไม่ได้ ใช้ engine 'c' (ข้อผิดพลาดจะถูกแจ้งจาก engine นี้แทน)
+        df = pd.read_csv(io.BytesIO(file_bytes), engine='c', dtype=CSV_DTYPES)
+    if 'datetime' in df.columns:
+        # แปลงคอลัมน์ datetime ครั้งเดียวตอนอ่านไฟล์ (ผลถูกแคชไว้พร้อมกัน) ฟังก์ชันอื่นจึงไม่ต้องแปลงซ้ำ
+        df['datetime'] = parse_datetime(df['datetime'])
+        # เรียงตามเวลาครั้งเดียวที่นี่ (NaT อยู่ท้ายสุด) เพื่อให้ filter_by_datetime ใช้ searchsorted ได้ทันที
+        # หมายเหตุ: แถวจะถูกเรียงใหม่และ index เริ่มนับใหม่จาก 0 เมื่อไฟล์ไม่ได้เรียงตามเวลามาก่อน
+        if not df['datetime'].is_monotonic_increasing:
+            df = df.sort_values('datetime', kind='stable', ignore_index=True)
+    return df
+
+def read_csv_pyarrow(file_bytes):
+    # pyarrow อ่าน CSV ได้เร็วกว่า engine ปกติหลายเท่า และแปลงคอลัมน์วันเวลาให้ระหว่างอ่าน
+    try:
+        df = pd.read_csv(io.BytesIO(file_bytes), engine='pyarrow', dtype=CSV_DTYPES)
+    except (ImportError, ValueError):
+        return None
+    # pyarrow แปลงเวลาที่มี timezone เป็น UTC ทำให้เวลาท้องถิ่นเลื่อน ไฟล์แบบนี้จึงให้ engine 'c' อ่านแทน
+    if 'datetime' in df.columns and isinstance(df['datetime'].dtype, pd.DatetimeTZDtype):
+        return None
+    return df
+
+def parse_datetime(values):
+    if pd.api.types.is_datetime64_any_dtype(values):
+        parsed = values
+    else:
+        # ระบุรูปแบบไว้ก่อนเพื่อข้ามการเดารูปแบบทีละค่า ถ้ามีค่าที่ไม่ตรงรูปแบบ (เช่นมี timezone) จึงแปลงแบบยืดหยุ่น
+        parsed = pd.to_datetime(values, format='%Y-%m-%d %H:%M:%S', errors='coerce', cache=True)
+        if (parsed.isna() & values.notna()).any():
+            parsed = pd.to_datetime(values, errors='coerce', cache=True)
+    if isinstance(parsed.dtype, pd.DatetimeTZDtype):
+        parsed = parsed.dt.tz_localize(None)  # แปลงเป็น timezone-naive
+    return parsed.astype('datetime64[ns]')
+
 def fix_outliers_based_on_neighbors(data, threshold=0.5, decimal_threshold=0.01):
     # คำนวณค่าเฉลี่ยระหว่างค่าแถวก่อนหน้าและแถวถัดไป
     data['avg_neighbors'] = (data['wl_up'].shift(1) + data['wl_up'].shift(-1)) / 2
@@ -61,9 +110,12 @@ def fix_outliers_based_on_neighbors(data, threshold=0.5, decimal_threshold=0.01)
     
     return data
 
+@st.cache_data(show_spinner=False)
 def clean_data(df):
-    data_clean = df.copy()
-    data_clean['datetime'] = pd.to_datetime(data_clean['datetime'], errors='coerce')
+    # คัดลอกแบบตื้น (ภายใต้ Copy-on-Write การแก้คอลัมน์จะไม่ย้อนกลับไปที่ df ของผู้เรียก)
+    data_clean = df.copy(deep=False)
+    if not pd.api.types.is_datetime64_any_dtype(data_clean['datetime']):
+        data_clean['datetime'] = parse_datetime(data_clean['datetime'])
     data_clean = data_clean.dropna(subset=['datetime'])
     data_clean = data_clean[(data_clean['wl_up'] >= -100)]
     data_clean = data_clean[(data_clean['wl_up'] != 0) & (~data_clean['wl_up'].isna())]
@@ -73,19 +125,35 @@ def clean_data(df):
     
     return data_clean
 
+# ไม่ใช้ st.cache_data ที่นี่: การ hash DataFrame ขาเข้าใช้เวลาพอ ๆ กับการคำนวณฟีเจอร์เอง และฟังก์ชันนี้เพิ่มคอลัมน์ลงใน
+# DataFrame ที่ส่งเข้ามาโดยตรง แคชจึงเก็บไว้เฉพาะขั้นอ่านไฟล์ (read_csv_cached) และทำความสะอาดข้อมูล (clean_data)
 def create_time_features(data_clean):
-    if not pd.api.types.is_datetime64_any_dtype(data_clean['datetime']):
-        data_clean['datetime'] = pd.to_datetime(data_clean['datetime'], errors='coerce')
-
-    data_clean['year'] = data_clean['datetime'].dt.year
-    data_clean['month'] = data_clean['datetime'].dt.month
-    data_clean['day'] = data_clean['datetime'].dt.day
-    data_clean['hour'] = data_clean['datetime'].dt.hour
-    data_clean['minute'] = data_clean['datetime'].dt.minute
-    data_clean['day_of_week'] = data_clean['datetime'].dt.dayofweek
-    data_clean['day_of_year'] = data_clean['datetime'].dt.dayofyear
-    data_clean['week_of_year'] = data_clean['datetime'].dt.isocalendar().week
-    data_clean['days_in_month'] = data_clean['datetime'].dt.days_in_month
+    # คำนวณฟีเจอร์เวลาทั้งหมดจาก array datetime64 ชุดเดียว แทนการเรียก .dt ทีละตัว
+    dt = data_clean['datetime'].to_numpy(dtype='datetime64[ns]')
+    years = dt.astype('datetime64[Y]')
+    months = dt.astype('datetime64[M]')
+    days = dt.astype('datetime64[D]')
+
+    year = years.astype(np.int64) + 1970
+    minute_of_day = (dt - days) // np.timedelta64(1, 'm')
+    day_of_week = (days.astype(np.int64) + 3) % 7  # 1970-01-01 เป็นวันพฤหัสบดี (จันทร์ = 0)
+    day_of_year = (days - years).astype(np.int64) + 1
+
+    # สัปดาห์ตาม ISO 8601 (เหมือน isocalendar().week)
+    week_of_year = (day_of_year - day_of_week + 9) // 7
+    week_of_year = np.where(week_of_year > iso_weeks_in_year(year), 1, week_of_year)
+    week_of_year = np.where(week_of_year < 1, iso_weeks_in_year(year - 1), week_of_year)
+
+    # เก็บเป็นจำนวนเต็มขนาดเล็ก (ค่าทุกตัวอยู่ในช่วงของ int16/int8) เพื่อลดหน่วยความจำ
+    data_clean['year'] = year.astype(np.int16)
+    data_clean['month'] = (months.astype(np.int64) % 12 + 1).astype(np.int8)
+    data_clean['day'] = ((days - months).astype(np.int64) + 1).astype(np.int8)
+    data_clean['hour'] = (minute_of_day // 60).astype(np.int8)
+    data_clean['minute'] = (minute_of_day % 60).astype(np.int8)
+    data_clean['day_of_week'] = day_of_week.astype(np.int8)
+    data_clean['day_of_year'] = day_of_year.astype(np.int16)
+    data_clean['week_of_year'] = week_of_year.astype(np.int8)
+    data_clean['days_in_month'] = ((months + 1).astype('datetime64[D]') - months).astype(np.int8)
 
     return data_clean
 
@@ -95,17 +163,24 @@ def prepare_features(data_clean):
         'day_of_week', 'day_of_year', 'week_of_year',
         'days_in_month', 'wl_up_prev'
     ]
-    X = data_clean[feature_cols]
-    y = data_clean['wl_up']
+    # โมเดลต้นไม้ของ sklearn แปลง X เป็น float32 อยู่แล้ว จึงแปลงครั้งเดียวที่นี่เพื่อไม่ให้คัดลอกซ้ำทุกครั้งที่ fit
+    X = data_clean[feature_cols].astype(np.float32)
+    y = data_clean['wl_up'].to_numpy(dtype=np.float32)
     return X, y
 
 def train_and_evaluate_model(X, y, model_type='random_forest'):
+    # แปลงเป็น ndarray float32 ที่ต่อเนื่องในหน่วยความจำครั้งเดียว เพื่อไม่ให้ sklearn ตรวจสอบ/คัดลอก DataFrame ซ้ำทุก fold
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    y = np.ascontiguousarray(y, dtype=np.float32)
+
     # แบ่งข้อมูลเป็นชุดฝึกและชุดทดสอบ
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
     # ฝึกโมเดลด้วยชุดฝึก
     if model_type == 'random_forest':
         model = train_random_forest(X_train, y_train)
+    elif model_type == 'hist_gradient_boosting':
+        model = train_hist_gradient_boosting(X_train, y_train)
     elif model_type == 'linear_regression':
         model = train_linear_regression_model(X_train, y_train)
     else:
@@ -118,32 +193,81 @@ def train_and_evaluate_model(X, y, model_type='random_forest'):
         return None
     return model
 
-def train_random_forest(X_train, y_train):
-    param_distributions = {
-        'n_estimators': [100, 200, 500],
-        'max_depth': [None, 10, 20],
-        'min_samples_split': [2, 5],
-        'min_samples_leaf': [1, 2],
-        'max_features': ['auto', 'sqrt'],
-        'bootstrap': [True, False]
-    }
+# จำกัดจำนวนและอายุของแคชโมเดล: cache_resource แชร์ระหว่างทุก session และป่าไม้หนึ่งชุดอาจใช้หน่วยความจำหลายร้อย MB
+MODEL_CACHE_MAX_ENTRIES = 2
+TUNING_CACHE_MAX_ENTRIES = 16
+MODEL_CACHE_TTL = 3600  # วินาที
 
-    rf = RandomForestRegressor(random_state=42)
+def train_random_forest(X_train, y_train):
+    # ค้นหาพารามิเตอร์ครั้งเดียวต่อชุดข้อมูล (ผลถูกแคชไว้) แล้วฝึกโมเดลด้วยพารามิเตอร์ที่ดีที่สุด
+    best_params = tune_random_forest(X_train, y_train)
+    return fit_random_forest(X_train, y_train, best_params)
 
+def search_best_params(estimator, param_distributions, X_train, y_train):
     tscv = TimeSeriesSplit(n_splits=5)
     random_search = RandomizedSearchCV(
-        estimator=rf,
+        estimator=estimator,
         param_distributions=param_distributions,
         n_iter=20,
         cv=tscv,
         n_jobs=-1,
         verbose=2,
         random_state=42,
-        scoring='neg_mean_absolute_error'
+        scoring='neg_mean_absolute_error',
+        refit=False  # ฝึกโมเดลสุดท้ายเองในฟังก์ชัน fit_*
     )
     random_search.fit(X_train, y_train)
 
-    return random_search.best_estimator_
+    return random_search.best_params_
+
+@st.cache_data(show_spinner=False, max_entries=TUNING_CACHE_MAX_ENTRIES, ttl=MODEL_CACHE_TTL)
+def tune_random_forest(X_train, y_train):
+    param_distributions = {
+        'n_estimators': [100, 200, 500],
+        'max_depth': [None, 10, 20],
+        'min_samples_split': [2, 5],
+        'min_samples_leaf': [1, 2],
+        'max_features': [1.0, 'sqrt'],  # 1.0 คือค่าเดียวกับ 'auto' เดิม (sklearn รุ่นใหม่ไม่รับ 'auto' แล้ว)
+        'bootstrap': [True, False]
+    }
+
+    # ระหว่างค้นหาพารามิเตอร์ RandomizedSearchCV ขนานระดับ candidate อยู่แล้ว จึงให้แต่ละป่าใช้ 1 core เพื่อไม่ให้แย่ง CPU กัน
+    rf = RandomForestRegressor(random_state=42, n_jobs=1)
+    return search_best_params(rf, param_distributions, X_train, y_train)
+
+# เก็บโมเดลที่ฝึกแล้วไว้ใช้ซ้ำข้ามการ rerun (โมเดลถูกใช้พยากรณ์อย่างเดียว จึงแชร์อ็อบเจกต์เดียวกันได้)
+@st.cache_resource(show_spinner=False, max_entries=MODEL_CACHE_MAX_ENTRIES, ttl=MODEL_CACHE_TTL)
+def fit_random_forest(X_train, y_train, params):
+    # โมเดลสุดท้ายฝึกครั้งเดียว จึงสร้างต้นไม้ (และพยากรณ์) ขนานกันทุก core
+    model = RandomForestRegressor(random_state=42, n_jobs=-1, **params)
+    model.fit(X_train, y_train)
+    return model
+
+def train_hist_gradient_boosting(X_train, y_train):
+    # HistGradientBoosting แบ่งค่าฟีเจอร์เป็น bin (uint8) ก่อนฝึก ทำให้ฝึกและพยากรณ์ได้เร็วกว่า Random Forest ที่ลึกมาก
+    best_params = tune_hist_gradient_boosting(X_train, y_train)
+    return fit_hist_gradient_boosting(X_train, y_train, best_params)
+
+@st.cache_data(show_spinner=False, max_entries=TUNING_CACHE_MAX_ENTRIES, ttl=MODEL_CACHE_TTL)
+def tune_hist_gradient_boosting(X_train, y_train):
+    param_distributions = {
+        'max_iter': [100, 200, 500],
+        'max_depth': [None, 8, 16],
+        'learning_rate': [0.05, 0.1],
+        'l2_regularization': [0, 0.1],
+        'max_bins': [255]
+    }
+
+    # HistGradientBoosting ไม่มี n_jobs แต่ใช้ thread ของ OpenMP: ระหว่างค้นหาพารามิเตอร์ joblib (loky) จำกัด thread
+    # ในแต่ละ worker ให้เอง ส่วนการฝึกโมเดลสุดท้ายใน fit_hist_gradient_boosting ทำใน process หลักจึงใช้ได้ทุก core
+    hgb = HistGradientBoostingRegressor(random_state=42, early_stopping=True)
+    return search_best_params(hgb, param_distributions, X_train, y_train)
+
+@st.cache_resource(show_spinner=False, max_entries=MODEL_CACHE_MAX_ENTRIES, ttl=MODEL_CACHE_TTL)
+def fit_hist_gradient_boosting(X_train, y_train, params):
+    model = HistGradientBoostingRegressor(random_state=42, early_stopping=True, **params)
+    model.fit(X_train, y_train)
+    return model
 
 def train_linear_regression_model(X_train, y_train):
     model = LinearRegression()
@@ -152,40 +276,46 @@ def train_linear_regression_model(X_train, y_train):
 
 # ฟังก์ชันเพิ่มเติมจากโค้ดแรก
 def generate_missing_dates(data):
-    full_date_range = pd.date_range(start=data['datetime'].min(), end=data['datetime'].max(), freq='15T')
-    all_dates = pd.DataFrame(full_date_range, columns=['datetime'])
-    data_with_all_dates = pd.merge(all_dates, data, on='datetime', how='left')
+    full_date_range = pd.date_range(start=data['datetime'].min(), end=data['datetime'].max(), freq='15min')
+    # reindex ต้องการ datetime ที่ไม่ซ้ำกัน จึงเก็บเฉพาะแถวแรกของเวลาที่ซ้ำ
+    data_unique = data[~data['datetime'].duplicated()]
+    data_with_all_dates = data_unique.set_index('datetime').reindex(full_date_range).rename_axis('datetime').reset_index()
     return data_with_all_dates
 
 def fill_code_column(data):
     if 'code' in data.columns:
-        data['code'] = data['code'].fillna(method='ffill').fillna(method='bfill')
+        data['code'] = data['code'].ffill().bfill()
     return data
 
 def handle_missing_values_by_week(data_clean, start_date, end_date, model_type='random_forest'):
     feature_cols = ['year', 'month', 'day', 'hour', 'minute',
                     'day_of_week', 'day_of_year', 'week_of_year', 'days_in_month', 'wl_up_prev']
 
-    data = data_clean.copy()
-
     # Convert start_date and end_date to datetime
     start_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
 
     # Filter data based on the datetime range
-    data = data[(data['datetime'] >= start_date) & (data['datetime'] <= end_date)]
+    data = filter_by_datetime(data_clean, start_date, end_date)
 
     # Generate all missing dates within the selected range
     data_with_all_dates = generate_missing_dates(data)
     data_with_all_dates.index = pd.to_datetime(data_with_all_dates['datetime'])
-    data_missing = data_with_all_dates[data_with_all_dates['wl_up'].isnull()]
-    data_not_missing = data_with_all_dates.dropna(subset=['wl_up'])
+    missing_mask = data_with_all_dates['wl_up'].isnull().to_numpy()
+    data_missing = data_with_all_dates[missing_mask]
+    data_not_missing = data_with_all_dates[~missing_mask]
+
+    # จองคอลัมน์สำหรับค่าที่เติมไว้ล่วงหน้า เพื่อเขียนผลพยากรณ์ลงไปทีเดียวโดยไม่ต้องเปลี่ยน dtype
+    wl_forecast = np.full(len(data_with_all_dates), np.nan, dtype='float32')
+    forecast_timestamp = np.full(len(data_with_all_dates), np.datetime64('NaT'), dtype='datetime64[ns]')
+    data_with_all_dates['wl_forecast'] = wl_forecast
+    data_with_all_dates['timestamp'] = forecast_timestamp
 
     # เติมค่า missing ใน wl_up_prev
     if 'wl_up_prev' in data_with_all_dates.columns:
-        data_with_all_dates['wl_up_prev'] = data_with_all_dates['wl_up_prev'].interpolate(method='linear')
+        data_with_all_dates['wl_up_prev'] = interpolate_linear(data_with_all_dates['wl_up_prev'])
     else:
-        data_with_all_dates['wl_up_prev'] = data_with_all_dates['wl_up'].shift(1).interpolate(method='linear')
+        data_with_all_dates['wl_up_prev'] = interpolate_linear(data_with_all_dates['wl_up'].shift(1))
 
     if len(data_missing) == 0:
         st.write("No missing values to predict.")
@@ -200,17 +330,26 @@ def handle_missing_values_by_week(data_clean, start_date, end_date, model_type='
         st.error("ไม่สามารถสร้างโมเดลได้ กรุณาตรวจสอบข้อมูล")
         return data_with_all_dates
 
-    # Fill missing values
-    for idx, row in data_missing.iterrows():
-        X_missing = row[feature_cols].values.reshape(1, -1)
-        try:
-            predicted_value = model.predict(X_missing)[0]
-            # บันทึกค่าที่เติมในคอลัมน์ wl_forecast และ timestamp
-            data_with_all_dates.loc[idx, 'wl_forecast'] = predicted_value
-            data_with_all_dates.loc[idx, 'timestamp'] = pd.Timestamp.now()
-        except Exception as e:
-            st.warning(f"ไม่สามารถพยากรณ์ค่าในแถว {idx} ได้: {e}")
-            continue
+    # Fill missing values (พยากรณ์ทุกแถวที่หายไปในครั้งเดียว)
+    # โมเดลถูกฝึกด้วย ndarray จึงส่ง ndarray ชนิดเดียวกันให้ predict
+    # (อ่านฟีเจอร์จาก data_with_all_dates ซึ่งเติม wl_up_prev แล้ว ไม่ใช่ data_missing ที่แยกออกมาก่อนเติม)
+    # แถวที่มี wl_up_prev อยู่แล้วได้ค่าเดิมทุกตัว (interpolate_linear ไม่แก้ค่าที่มีอยู่) จึงพยากรณ์ได้ผลเหมือนเดิม
+    # ส่วนแถวที่ wl_up_prev ว่าง (เช่นแถวที่ reindex เพิ่มเข้ามา) จะใช้ค่าที่เติมแล้วแทน NaN
+    X_missing = np.ascontiguousarray(data_with_all_dates.loc[missing_mask, feature_cols], dtype=np.float32)
+    # แถวที่มีฟีเจอร์ไม่สมบูรณ์ (NaN/inf) ข้ามไปทีละแถว เพื่อไม่ให้ทั้งชุดพยากรณ์ไม่ได้
+    valid_rows = np.isfinite(X_missing).all(axis=1)
+    if not valid_rows.all():
+        st.warning(f"ไม่สามารถพยากรณ์ค่าได้ {int((~valid_rows).sum())} แถว เนื่องจากฟีเจอร์ไม่สมบูรณ์")
+    valid_positions = np.flatnonzero(missing_mask)[valid_rows]
+    try:
+        if len(valid_positions) > 0:
+            wl_forecast[valid_positions] = model.predict(X_missing[valid_rows])
+            forecast_timestamp[valid_positions] = pd.Timestamp.now().to_datetime64()
+        # บันทึกค่าที่เติมในคอลัมน์ wl_forecast และ timestamp
+        data_with_all_dates['wl_forecast'] = wl_forecast
+        data_with_all_dates['timestamp'] = forecast_timestamp
+    except Exception as e:
+        st.warning(f"ไม่สามารถพยากรณ์ค่าที่หายไปได้: {e}")
 
     # สร้างคอลัมน์ wl_up2 ที่รวมข้อมูลเดิมกับค่าที่เติม
     data_with_all_dates['wl_up2'] = data_with_all_dates['wl_up'].combine_first(data_with_all_dates['wl_forecast'])
@@ -224,7 +363,7 @@ def delete_data_by_date_range(data, delete_start_date, delete_end_date):
     delete_end_date = pd.to_datetime(delete_end_date)
 
     # ตรวจสอบว่าช่วงวันที่ต้องการลบข้อมูลอยู่ในช่วงของ data หรือไม่
-    data_to_delete = data[(data['datetime'] >= delete_start_date) & (data['datetime'] <= delete_end_date)]
+    data_to_delete = filter_by_datetime(data, delete_start_date, delete_end_date)
 
     # เพิ่มการตรวจสอบว่าถ้าจำนวนข้อมูลที่ถูกลบมีมากเกินไป
     if len(data_to_delete) == 0:
@@ -260,34 +399,22 @@ def calculate_accuracy_metrics(original, filled):
         st.metric(label="R-squared (R²)", value=f"{r2:.4f}")
 
 def plot_results(data_before, data_filled, data_deleted, data_deleted_option=False):
-    data_before_filled = pd.DataFrame({
-        'วันที่': data_before['datetime'],
-        'ข้อมูลเดิม': data_before['wl_up']
-    })
-
-    data_after_filled = pd.DataFrame({
-        'วันที่': data_filled['datetime'],
-        'ข้อมูลหลังเติมค่า': data_filled['wl_up2']
-    })
+    series_list = [
+        series_by_datetime(data_before, 'wl_up', 'ข้อมูลเดิม'),
+        series_by_datetime(data_filled, 'wl_up2', 'ข้อมูลหลังเติมค่า')
+    ]
 
-    # เงื่อนไขในการสร้าง DataFrame สำหรับข้อมูลหลังลบ
+    # เงื่อนไขในการสร้างข้อมูลหลังลบ
     if data_deleted_option:
-        data_after_deleted = pd.DataFrame({
-            'วันที่': data_deleted['datetime'],
-            'ข้อมูลหลังลบ': data_deleted['wl_up']
-        })
-    else:
-        data_after_deleted = None
-
-    # รวมข้อมูล
-    combined_data = pd.merge(data_before_filled, data_after_filled, on='วันที่', how='outer')
+        series_list.append(series_by_datetime(data_deleted, 'wl_up', 'ข้อมูลหลังลบ'))
 
-    if data_after_deleted is not None:
-        combined_data = pd.merge(combined_data, data_after_deleted, on='วันที่', how='outer')
+    # รวมข้อมูลโดยจัดแนวตาม datetime index แทนการ merge แบบ outer
+    combined_data = pd.concat(series_list, axis=1, join='outer')
+    combined_data = downsample_for_chart(combined_data).rename_axis('วันที่').reset_index()
 
     # กำหนดรายการ y ที่จะแสดงในกราฟ
     y_columns = ['ข้อมูลหลังเติมค่า', 'ข้อมูลเดิม']
-    if data_after_deleted is not None:
+    if data_deleted_option:
         y_columns.append('ข้อมูลหลังลบ')
 
     # Plot ด้วย Plotly
@@ -328,6 +455,7 @@ def plot_data_preview(df_pre, df2_pre, total_time_lag):
             'สถานีก่อนหน้า': df2_pre['wl_up']
         })
         combined_data_pre = pd.merge(data_pre1, data_pre2, on='datetime', how='outer')
+        combined_data_pre = downsample_for_chart(combined_data_pre.set_index('datetime')).reset_index()
 
         # Plot ด้วย Plotly และกำหนด color_discrete_sequence
         fig = px.line(
@@ -349,6 +477,7 @@ def plot_data_preview(df_pre, df2_pre, total_time_lag):
 
     else:
         # ถ้าไม่มีไฟล์ที่สอง ให้แสดงกราฟของไฟล์แรกเท่านั้น
+        data_pre1 = downsample_for_chart(data_pre1.set_index('datetime')).reset_index()
         fig = px.line(
             data_pre1, 
             x='datetime', 
@@ -367,7 +496,10 @@ def plot_data_preview(df_pre, df2_pre, total_time_lag):
 
 def merge_data(df1, df2=None):
     if df2 is not None:
-        merged_df = pd.merge(df1, df2[['datetime', 'wl_up']], on='datetime', how='left', suffixes=('', '_prev'))
+        # ดึงค่า wl_up ของสถานีใกล้เคียงตาม datetime ด้วย reindex แทน merge
+        upstream_wl_up = series_by_datetime(df2, 'wl_up', 'wl_up_prev')
+        merged_df = df1.copy()
+        merged_df['wl_up_prev'] = upstream_wl_up.reindex(pd.DatetimeIndex(df1['datetime'])).to_numpy()
     else:
         # ถ้าไม่มี df2 ให้สร้างคอลัมน์ 'wl_up_prev' จาก 'wl_up' ของ df1 (shifted by 1)
         df1['wl_up_prev'] = df1['wl_up'].shift(1)
@@ -408,11 +540,13 @@ def forecast_with_linear_regression_single(data, forecast_start_date):
 
     # เทรนโมเดล Linear Regression
     model = LinearRegression()
-    model.fit(X_train, y_train)
+    model.fit(X_train.to_numpy(), y_train.to_numpy())
+    # การพยากรณ์ทีละขั้นเป็นแค่ผลคูณเชิงเส้น จึงคำนวณจากค่าสัมประสิทธิ์ตรง ๆ แทนการเรียก model.predict ทุกขั้น
+    coef, intercept = model.coef_, model.intercept_
 
     # สร้าง DataFrame สำหรับการพยากรณ์
     forecast_periods = 96  # พยากรณ์ 1 วัน (96 ช่วงเวลา 15 นาที)
-    forecast_index = pd.date_range(start=forecast_start_date, periods=forecast_periods, freq='15T')
+    forecast_index = pd.date_range(start=forecast_start_date, periods=forecast_periods, freq='15min')
     forecasted_data = pd.DataFrame(index=forecast_index, columns=['wl_up'])
 
     # สร้างชุดข้อมูลสำหรับการพยากรณ์
@@ -421,19 +555,18 @@ def forecast_with_linear_regression_single(data, forecast_start_date):
     combined_data = data.copy()
 
     # การพยากรณ์
+    x_pred = np.empty(len(lags))
     for idx in forecasted_data.index:
-        lag_features = {}
-        for lag in lags:
+        for i, lag in enumerate(lags):
             lag_time = idx - pd.Timedelta(minutes=15 * lag)
             if lag_time in combined_data.index and not pd.isnull(combined_data.at[lag_time, 'wl_up']):
                 lag_value = combined_data.at[lag_time, 'wl_up']
             else:
                 # ถ้าไม่มีค่า lag ให้ใช้ค่าเฉลี่ยของ y_train
                 lag_value = y_train.mean()
-            lag_features[f'lag_{lag}'] = lag_value
+            x_pred[i] = lag_value
 
-        X_pred = pd.DataFrame([lag_features])
-        forecast_value = model.predict(X_pred)[0]
+        forecast_value = intercept + x_pred @ coef
         forecasted_data.at[idx, 'wl_up'] = forecast_value
 
         # อัปเดต 'combined_data' ด้วยค่าที่พยากรณ์เพื่อใช้ในการพยากรณ์ครั้งถัดไป
@@ -493,11 +626,13 @@ def forecast_with_linear_regression_two(data, upstream_data, forecast_start_date
 
     # เทรนโมเดล Linear Regression
     model = LinearRegression()
-    model.fit(X_train, y_train)
+    model.fit(X_train.to_numpy(), y_train.to_numpy())
+    # การพยากรณ์ทีละขั้นเป็นแค่ผลคูณเชิงเส้น จึงคำนวณจากค่าสัมประสิทธิ์ตรง ๆ แทนการเรียก model.predict ทุกขั้น
+    coef, intercept = model.coef_, model.intercept_
 
     # สร้าง DataFrame สำหรับการพยากรณ์
     forecast_periods = 96  # พยากรณ์ 1 วัน (96 ช่วงเวลา 15 นาที)
-    forecast_index = pd.date_range(start=forecast_start_date, periods=forecast_periods, freq='15T')
+    forecast_index = pd.date_range(start=forecast_start_date, periods=forecast_periods, freq='15min')
     forecasted_data = pd.DataFrame(index=forecast_index, columns=['wl_up'])
 
     # สร้างชุดข้อมูลสำหรับการพยากรณ์
@@ -531,8 +666,8 @@ def forecast_with_linear_regression_two(data, upstream_data, forecast_start_date
         # ตรวจสอบว่าฟีเจอร์ทั้งหมดสอดคล้องกับฟีเจอร์ที่ใช้เทรนโมเดล
         lag_features = {key: lag_features[key] for key in feature_cols if key in lag_features}
 
-        X_pred = pd.DataFrame([lag_features])
-        forecast_value = model.predict(X_pred)[0]
+        x_pred = np.fromiter(lag_features.values(), dtype=np.float64, count=len(lag_features))
+        forecast_value = intercept + x_pred @ coef
         forecasted_data.at[idx, 'wl_up'] = forecast_value
 
         # อัปเดต 'combined_data' และ 'combined_upstream' ด้วยค่าที่พยากรณ์เพื่อใช้ในการพยากรณ์ครั้งถัดไป
@@ -596,7 +731,7 @@ st.set_page_config(
 st.markdown("""
 # การพยากรณ์ระดับน้ำ
 
-แอป Streamlit สำหรับจัดการข้อมูลระดับน้ำ โดยใช้โมเดล **Random Forest** หรือ **Linear Regression** เพื่อเติมค่าที่ขาดหายไปและพยากรณ์ข้อมูล
+แอป Streamlit สำหรับจัดการข้อมูลระดับน้ำ โดยใช้โมเดล **Random Forest** หรือ **Histogram Gradient Boosting** (เลือกได้ในการตั้งค่า) หรือ **Linear Regression** เพื่อเติมค่าที่ขาดหายไปและพยากรณ์ข้อมูล
 ข้อมูลถูกประมวลผลและแสดงผลผ่านกราฟและการวัดค่าความแม่นยำ ผู้ใช้สามารถเลือกอัปโหลดไฟล์, 
 กำหนดช่วงเวลาลบข้อมูล และเลือกวิธีการพยากรณ์ได้
 """)
@@ -613,6 +748,10 @@ with st.sidebar:
     st.sidebar.title("ตั้งค่าข้อมูล")
     if model_choice == "Random Forest":
         with st.sidebar.expander("ตั้งค่า Random Forest", expanded=False):
+            # เลือกโมเดลที่ใช้เติมค่าที่หายไป (Histogram Gradient Boosting ฝึกได้เร็วกว่า Random Forest มาก)
+            fill_model_choice = st.radio("โมเดลที่ใช้เติมค่า", ("Histogram Gradient Boosting", "Random Forest"))
+            fill_model_type = 'hist_gradient_boosting' if fill_model_choice == "Histogram Gradient Boosting" else 'random_forest'
+
             use_second_file = st.checkbox("ต้องการใช้สถานีใกล้เคียง", value=False)
             
             # สลับตำแหน่งการอัปโหลดไฟล์
@@ -708,18 +847,15 @@ if model_choice == "Random Forest":
                     processing_placeholder = st.empty()
                     processing_placeholder.text("กำลังประมวลผลข้อมูล...")
 
-                    df['datetime'] = pd.to_datetime(df['datetime']).dt.tz_localize(None)
-
                     # ปรับค่า end_date เฉพาะถ้าเลือกช่วงเวลาแล้ว
                     end_date_dt = pd.to_datetime(end_date) + pd.DateOffset(days=1)
 
                     # กรองข้อมูลตามช่วงวันที่เลือก
-                    df_filtered = df[(df['datetime'] >= pd.to_datetime(start_date)) & (df['datetime'] <= pd.to_datetime(end_date_dt))]
+                    df_filtered = filter_by_datetime(df, pd.to_datetime(start_date), end_date_dt)
 
                     if use_second_file and uploaded_file2 and df2 is not None:
                         # ปรับเวลาของสถานีก่อนหน้าตามเวลาห่างที่ระบุ
-                        df2['datetime'] = pd.to_datetime(df2['datetime']).dt.tz_localize(None)
-                        df2_filtered = df2[(df2['datetime'] >= pd.to_datetime(start_date)) & (df2['datetime'] <= pd.to_datetime(end_date_dt))]
+                        df2_filtered = filter_by_datetime(df2, pd.to_datetime(start_date), end_date_dt)
                         df2_filtered['datetime'] = df2_filtered['datetime'] + total_time_lag
                         df2_clean = clean_data(df2_filtered)
                     else:
@@ -754,13 +890,13 @@ if model_choice == "Random Forest":
                     # เติมค่า missing ใน 'wl_up_prev'
                     if 'wl_up_prev' not in df_clean.columns:
                         df_clean['wl_up_prev'] = df_clean['wl_up'].shift(1)
-                    df_clean['wl_up_prev'] = df_clean['wl_up_prev'].interpolate(method='linear')
+                    df_clean['wl_up_prev'] = interpolate_linear(df_clean['wl_up_prev'])
 
                     # **สามารถลบหรือปรับส่วนนี้ได้ถ้าไม่ต้องการใช้ df_before_deletion = df_filtered.copy() อีกต่อไป**
                     # df_before_deletion = df_filtered.copy()
 
                     # Handle missing values by week
-                    df_handled = handle_missing_values_by_week(df_clean, start_date, end_date, model_type='random_forest')
+                    df_handled = handle_missing_values_by_week(df_clean, start_date, end_date, model_type=fill_model_type)
 
                     # Remove the processing message after the processing is complete
                     processing_placeholder.empty()
@@ -776,7 +912,7 @@ elif model_choice == "Linear Regression":
     if uploaded_fill_file:
         # โหลดข้อมูลของสถานีที่ต้องการทำนาย
         try:
-            target_df = pd.read_csv(uploaded_fill_file)
+            target_df = read_csv_cached(uploaded_fill_file.getvalue())
         except Exception as e:
             st.error(f"เกิดข้อผิดพลาดในการโหลดไฟล์: {e}")
             target_df = pd.DataFrame()
@@ -789,15 +925,14 @@ elif model_choice == "Linear Regression":
                 st.error("หลังจากการทำความสะอาดข้อมูลแล้วไม่มีข้อมูลที่เหลือ")
             else:
                 target_df = generate_missing_dates(target_df)
-                target_df['datetime'] = pd.to_datetime(target_df['datetime'], errors='coerce').dt.tz_localize(None)  # แปลงเป็น timezone-naive
                 target_df = create_time_features(target_df)
                 target_df['wl_up_prev'] = target_df['wl_up'].shift(1)
-                target_df['wl_up_prev'] = target_df['wl_up_prev'].interpolate(method='linear')
+                target_df['wl_up_prev'] = interpolate_linear(target_df['wl_up_prev'])
 
                 # โหลดข้อมูลสถานีใกล้เคียงถ้าเลือกใช้
                 if use_upstream and uploaded_up_file:
                     try:
-                        upstream_df = pd.read_csv(uploaded_up_file)
+                        upstream_df = read_csv_cached(uploaded_up_file.getvalue())
                     except Exception as e:
                         st.error(f"เกิดข้อผิดพลาดในการโหลดไฟล์สถานีข้างบน: {e}")
                         upstream_df = pd.DataFrame()
@@ -812,10 +947,9 @@ elif model_choice == "Linear Regression":
                             upstream_df = pd.DataFrame()
                         else:
                             upstream_df = generate_missing_dates(upstream_df)
-                            upstream_df['datetime'] = pd.to_datetime(upstream_df['datetime'], errors='coerce').dt.tz_localize(None)  # แปลงเป็น timezone-naive
                             upstream_df = create_time_features(upstream_df)
                             upstream_df['wl_up_prev'] = upstream_df['wl_up'].shift(1)
-                            upstream_df['wl_up_prev'] = upstream_df['wl_up_prev'].interpolate(method='linear')
+                            upstream_df['wl_up_prev'] = interpolate_linear(upstream_df['wl_up_prev'])
                 else:
                     upstream_df = None
 
@@ -835,7 +969,7 @@ elif model_choice == "Linear Regression":
                         if start_datetime > end_datetime:
                             st.error("วันและเวลาที่เริ่มต้นต้องไม่เกินวันและเวลาสิ้นสุด")
                         else:
-                            selected_data = target_df[(target_df['datetime'] >= start_datetime) & (target_df['datetime'] <= end_datetime)].copy()
+                            selected_data = filter_by_datetime(target_df, start_datetime, end_datetime).copy()
 
                             if selected_data.empty:
                                 st.error("ไม่มีข้อมูลในช่วงวันที่ที่เลือก กรุณาเลือกวันที่ใหม่")
@@ -1,35 +1,74 @@
+import io
 import streamlit as st
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.model_selection import RandomizedSearchCV
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingRandomSearchCV
+from joblib import Parallel, cpu_count, delayed
+from threadpoolctl import threadpool_limits
 import altair as alt
-from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
+from data_utils import downsample_for_chart, filter_by_datetime, interpolate_linear, iso_weeks_in_year, series_by_datetime
 
 def load_data(file):
-    return pd.read_csv(file)
-
+    # ใช้ bytes ของไฟล์เป็น key ของแคช เพื่อไม่ต้องอ่าน CSV ซ้ำทุกครั้งที่ Streamlit rerun
+    return _read_csv(file.getvalue())
+
+@st.cache_data(show_spinner=False)
+def _read_csv(file_bytes):
+    try:
+        # ตัวอ่าน CSV ของ pyarrow อ่านแบบหลาย thread และแปลงคอลัมน์ datetime ได้ในขั้นตอนเดียว
+        df = pd.read_csv(io.BytesIO(file_bytes), engine='pyarrow', parse_dates=['datetime'])
+    except (ImportError, ValueError):
+        df = None
+    # pyarrow แปลงเวลาที่มี timezone เป็น UTC ทำให้เวลาท้องถิ่นเลื่อนเมื่อ tz_localize(None)
+    # ไฟล์แบบนี้ (และกรณีไม่มี pyarrow หรืออ่านไม่ได้) จึงให้ engine 'c' อ่านแทน โดยยังเก็บเวลาตามที่เขียนในไฟล์
+    if df is None or isinstance(df['datetime'].dtype, pd.DatetimeTZDtype):
+        df = pd.read_csv(io.BytesIO(file_bytes), engine='c')
+    return df
+
+@st.cache_data(show_spinner=False)
 def clean_data(df):
-    data_clean = df.copy()
-    data_clean['datetime'] = pd.to_datetime(data_clean['datetime'], errors='coerce')
-    data_clean = data_clean.dropna(subset=['datetime'])
-    data_clean = data_clean[(data_clean['wl_up'] >= 100) & (data_clean['wl_up'] <= 450)]
-    data_clean = data_clean[(data_clean['wl_up'] != 0) & (~data_clean['wl_up'].isna())]
-    return data_clean
+    datetime = pd.to_datetime(df['datetime'], errors='coerce')
+    wl_up = df['wl_up'].to_numpy()
 
+    # รวมเงื่อนไขทั้งหมดเป็น mask เดียว (ช่วง 100-450 ตัดค่า 0 และ NaN ออกไปด้วยแล้ว)
+    mask = datetime.notna().to_numpy() & (wl_up >= 100) & (wl_up <= 450)
+    return df.loc[mask].assign(datetime=datetime[mask])
+
+# ฟังก์ชันช่วงสร้างฟีเจอร์และเติมวันที่ไม่ใช้ st.cache_data: ถูกเรียกกับ DataFrame ใหม่ทุกครั้ง (แคชไม่เคย hit)
+# แต่ต้อง hash ข้อมูลทั้งก้อนทุกครั้ง และบางฟังก์ชันแก้ไข DataFrame ที่ส่งเข้ามาโดยตรง แคชจึงมีเฉพาะ _read_csv และ clean_data
 def create_time_features(data_clean):
     if not pd.api.types.is_datetime64_any_dtype(data_clean['datetime']):
         data_clean['datetime'] = pd.to_datetime(data_clean['datetime'], errors='coerce')
 
-    data_clean['year'] = data_clean['datetime'].dt.year
-    data_clean['month'] = data_clean['datetime'].dt.month
-    data_clean['day'] = data_clean['datetime'].dt.day
-    data_clean['hour'] = data_clean['datetime'].dt.hour
-    data_clean['minute'] = data_clean['datetime'].dt.minute
-    data_clean['day_of_week'] = data_clean['datetime'].dt.dayofweek
-    data_clean['day_of_year'] = data_clean['datetime'].dt.dayofyear
-    data_clean['week_of_year'] = data_clean['datetime'].dt.isocalendar().week
-    data_clean['days_in_month'] = data_clean['datetime'].dt.days_in_month
+    # คำนวณฟีเจอร์เวลาทั้งหมดจาก array datetime64 ชุดเดียว แทนการเรียก .dt ทีละตัว
+    dt = data_clean['datetime'].to_numpy(dtype='datetime64[ns]')
+    years = dt.astype('datetime64[Y]')
+    months = dt.astype('datetime64[M]')
+    days = dt.astype('datetime64[D]')
+
+    year = years.astype(np.int64) + 1970
+    minute_of_day = (dt - days) // np.timedelta64(1, 'm')
+    day_of_week = (days.astype(np.int64) + 3) % 7  # 1970-01-01 เป็นวันพฤหัสบดี (จันทร์ = 0)
+    day_of_year = (days - years).astype(np.int64) + 1
+
+    # สัปดาห์ตาม ISO 8601 (เหมือน isocalendar().week)
+    week_of_year = (day_of_year - day_of_week + 9) // 7
+    week_of_year = np.where(week_of_year > iso_weeks_in_year(year), 1, week_of_year)
+    week_of_year = np.where(week_of_year < 1, iso_weeks_in_year(year - 1), week_of_year)
+
+    data_clean['year'] = year
+    data_clean['month'] = months.astype(np.int64) % 12 + 1
+    data_clean['day'] = (days - months).astype(np.int64) + 1
+    data_clean['hour'] = minute_of_day // 60
+    data_clean['minute'] = minute_of_day % 60
+    data_clean['day_of_week'] = day_of_week
+    data_clean['day_of_year'] = day_of_year
+    data_clean['week_of_year'] = week_of_year
+    data_clean['days_in_month'] = ((months + 1).astype('datetime64[D]') - months).astype(np.int64)
+    # ลำดับสัปดาห์ (เริ่มวันจันทร์) นับต่อเนื่องจาก epoch ไม่วนกลับเมื่อขึ้นปีใหม่ ใช้เป็น key ในการแบ่งกลุ่มรายสัปดาห์
+    data_clean['week_idx'] = ((days.astype(np.int64) + 3) // 7).astype(np.int32)
 
     return data_clean
 
@@ -39,60 +78,120 @@ def prepare_features(data_clean):
         'day_of_week', 'day_of_year', 'week_of_year',
         'days_in_month'
     ]
-    X = data_clean[feature_cols]
+    # ฟีเจอร์เวลาเป็นจำนวนเต็มขนาดเล็ก ใช้ int8/int16 เพื่อลดหน่วยความจำและ bandwidth ตอนฝึกโมเดล
+    X = data_clean[feature_cols].astype({
+        'year': 'int16', 'month': 'int8', 'day': 'int8', 'hour': 'int8', 'minute': 'int8',
+        'day_of_week': 'int8', 'day_of_year': 'int16', 'week_of_year': 'int8', 'days_in_month': 'int8'
+    })
     y = data_clean['wl_up']
     return X, y
 
+# ชุดข้อมูลฝึกที่เล็กกว่านี้ (ประมาณหนึ่งสัปดาห์ของข้อมูลราย 15 นาที) ใช้โมเดลขนาดเล็กลง
+SMALL_TRAIN_SIZE = 1000
+
+# ใช้โมเดลที่ฝึกแล้วซ้ำเมื่อชุดข้อมูลฝึกเหมือนเดิม (เช่นกดประมวลผลใหม่ด้วยไฟล์และช่วงวันที่เดิม) แทนการค้นหาพารามิเตอร์ใหม่
+# cache_resource แชร์ระหว่างทุก session จึงจำกัดจำนวนและอายุของโมเดลที่เก็บไว้
+@st.cache_resource(show_spinner=False, max_entries=2, ttl=3600)
 def train_model(X_train, y_train):
-    param_distributions = {
-        'n_estimators': [100, 200, 500, 1000],  # ขยายช่วงของ n_estimators
-        'max_depth': [None, 10, 20, 50],  # ปรับ max_depth ให้กว้างขึ้น
-        'min_samples_split': [2, 5, 10],
-        'min_samples_leaf': [1, 2, 4],
-        'max_features': ['auto', 'sqrt', 'log2'],
-        'bootstrap': [True, False],  # ทดสอบการใช้ข้อมูลทั้งหมดในแต่ละต้นไม้หรือบางส่วน
-        'max_samples': [None, 0.8, 0.9]  # กำหนด max_samples เพื่อสุ่มตัวอย่างในแต่ละต้นไม้
-    }
-
-    rf = RandomForestRegressor(random_state=42)
+    if len(X_train) < SMALL_TRAIN_SIZE:
+        # เกิดเฉพาะเมื่อเลือกช่วงวันที่สั้นมาก (ไม่เกินประมาณ 10 วัน) ไม่ต้องการโมเดลใหญ่ จำกัดขอบเขตการค้นหาให้แคบลง
+        param_distributions = {
+            'learning_rate': [0.1, 0.2],
+            'max_iter': [30, 60],
+            'max_depth': [6, 10],
+            'min_samples_leaf': [1, 2],
+            'l2_regularization': [0.0, 0.1]
+        }
+    else:
+        param_distributions = {
+            'learning_rate': [0.03, 0.05, 0.1, 0.2],
+            'max_leaf_nodes': [15, 31, 63],
+            'max_depth': [None, 5, 10, 20],
+            'min_samples_leaf': [5, 10, 20],
+            'l2_regularization': [0.0, 0.1, 1.0]
+        }
+
+    # HistGradientBoosting แบ่งค่าฟีเจอร์เป็น bin (uint8) ครั้งเดียว ทำให้ฝึกและพยากรณ์ได้เร็วกว่า Random Forest มาก
+    model = HistGradientBoostingRegressor(random_state=42)
 
     n_splits = min(3, len(X_train) // 2)
-    random_search = RandomizedSearchCV(estimator=rf, param_distributions=param_distributions, n_iter=20, cv=n_splits, n_jobs=-1, verbose=2, random_state=42)
+    # successive halving: ประเมินหลายชุดพารามิเตอร์ด้วยข้อมูลส่วนน้อยก่อน แล้วคัดเฉพาะชุดที่ดีไปใช้ข้อมูลมากขึ้น
+    min_resources = min(len(X_train), max(200, len(X_train) // 8))
+    random_search = HalvingRandomSearchCV(estimator=model, param_distributions=param_distributions, factor=3, resource='n_samples', min_resources=min_resources, cv=n_splits, n_jobs=-1, verbose=2, random_state=42)
     random_search.fit(X_train, y_train)
 
     return random_search.best_estimator_
 
+def refine_model(base_model, X_train, y_train, extra_iter=20):
+    # ต่อยอดจากโมเดลหลักโดยฝึกต้นไม้เพิ่มเพียงไม่กี่ต้นบนค่าคลาดเคลื่อน (residual) ของข้อมูลช่วงนี้
+    # แทนการใช้ warm_start ตรง ๆ เพราะ HistGradientBoosting จะแบ่ง bin ใหม่ตามข้อมูลชุดใหม่ ทำให้ไม่ตรงกับต้นไม้เดิม
+    params = dict(base_model.get_params(), max_iter=extra_iter, early_stopping=False)
+    if len(X_train) < SMALL_TRAIN_SIZE:
+        # ข้อมูลของสัปดาห์ที่มีน้อย ไม่ต้องใช้ต้นไม้ลึกหรือหลายต้น ลดขนาดต้นไม้ค่าคลาดเคลื่อนลงเพื่อให้ฝึกเร็วขึ้น
+        base_depth = params['max_depth']
+        params.update(
+            max_iter=min(extra_iter, 10),
+            max_depth=6 if base_depth is None else min(base_depth, 6),
+            max_leaf_nodes=min(params['max_leaf_nodes'] or 15, 15),
+            min_samples_leaf=min(params['min_samples_leaf'], 5),
+        )
+    residual_model = HistGradientBoostingRegressor(**params)
+    residual_model.fit(X_train, y_train - base_model.predict(X_train))
+
+    def predict(X):
+        return base_model.predict(X) + residual_model.predict(X)
+    return predict
+
+def predict_gap(base_model, X_train, y_train, X_missing):
+    return refine_model(base_model, X_train, y_train)(X_missing)
+
 def generate_missing_dates(data):
-    full_date_range = pd.date_range(start=data['datetime'].min(), end=data['datetime'].max(), freq='15T')
-    all_dates = pd.DataFrame(full_date_range, columns=['datetime'])
-    data_with_all_dates = pd.merge(all_dates, data, on='datetime', how='left')
+    full_date_range = pd.date_range(start=data['datetime'].min(), end=data['datetime'].max(), freq='15min')
+    # reindex ต้องการ datetime ที่ไม่ซ้ำกัน จึงเก็บเฉพาะแถวแรกของเวลาที่ซ้ำ
+    data_unique = data[~data['datetime'].duplicated()]
+    data_with_all_dates = data_unique.set_index('datetime').reindex(full_date_range).rename_axis('datetime').reset_index()
     return data_with_all_dates
 
 def fill_code_column(data):
-    data['code'] = data['code'].fillna(method='ffill').fillna(method='bfill')
+    # ส่วนใหญ่คอลัมน์ code ไม่มีค่าว่าง จึงข้ามการ ffill/bfill ถ้าไม่จำเป็น
+    if data['code'].isna().any():
+        data['code'] = data['code'].ffill().bfill()
+    # code เป็นค่าซ้ำ ๆ ไม่กี่ค่า เก็บเป็น category เพื่อลดหน่วยความจำ
+    data['code'] = data['code'].astype('category')
     return data
 
+def rolling_mean(values, window_size):
+    # เทียบเท่า rolling(window=window_size, min_periods=1).mean() โดยใช้ผลรวมสะสม แทนการสร้างอ็อบเจกต์ Rolling
+    valid = ~np.isnan(values)
+    total = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+    count = np.concatenate(([0], np.cumsum(valid)))
+    upper = np.arange(1, len(values) + 1)
+    lower = np.maximum(upper - window_size, 0)
+    window_count = count[upper] - count[lower]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(window_count > 0, (total[upper] - total[lower]) / window_count, np.nan)
+
 def smooth_filled_values(data_with_all_dates, window_size=3):
     """Apply smoothing technique to reduce the sudden jumps in the filled values."""
-    data_with_all_dates['wl_up'] = data_with_all_dates['wl_up'].interpolate(method='linear')
-    data_with_all_dates['wl_up'] = data_with_all_dates['wl_up'].rolling(window=window_size, min_periods=1).mean()
+    wl_up = interpolate_linear(data_with_all_dates['wl_up'])
+    data_with_all_dates['wl_up'] = rolling_mean(wl_up, window_size)
     return data_with_all_dates
 
 def handle_missing_values_by_week(data_clean, start_date, end_date):
     feature_cols = ['year', 'month', 'day', 'hour', 'minute',
                     'day_of_week', 'day_of_year', 'week_of_year', 'days_in_month']
 
-    data = data_clean.copy()
-    
     # Convert start_date and end_date to datetime
     start_date = pd.to_datetime(start_date)
     end_date = pd.to_datetime(end_date)
 
-    # Filter data based on the datetime range
-    data = data[(data['datetime'] >= start_date) & (data['datetime'] <= end_date)]
+    # Filter data based on the datetime range (ไม่ต้องคัดลอกทั้ง data_clean ก่อน เพราะขั้นต่อไปสร้าง DataFrame ใหม่เสมอ)
+    data = filter_by_datetime(data_clean, start_date, end_date)
 
     # Generate all missing dates within the selected range
     data_with_all_dates = generate_missing_dates(data)
+    # แถวที่เพิ่งถูกเติมวันที่จะไม่มีฟีเจอร์เวลา จึงสร้างฟีเจอร์ใหม่ทั้งชุดก่อนแยกข้อมูลที่หายไป
+    data_with_all_dates = create_time_features(data_with_all_dates)
     data_with_all_dates.index = pd.to_datetime(data_with_all_dates['datetime'])
     data_missing = data_with_all_dates[data_with_all_dates['wl_up'].isnull()]
     data_not_missing = data_with_all_dates.dropna(subset=['wl_up'])
@@ -105,81 +204,86 @@ def handle_missing_values_by_week(data_clean, start_date, end_date):
         st.write("No missing values to predict.")
         return data_with_all_dates
 
-    # Train initial model with all available data
+    # Train initial model with all available data (ค้นหาพารามิเตอร์เพียงครั้งเดียว แล้วใช้เป็นฐานของทุกสัปดาห์)
     X_train, y_train = prepare_features(data_not_missing)
     model = train_model(X_train, y_train)
 
+    # เก็บค่าที่เติมไว้ใน numpy array ตามตำแหน่งแถว แล้วค่อยเขียนกลับเข้า DataFrame ครั้งเดียวหลังจบทุกลูป
+    wl_forecast = np.full(len(data_with_all_dates), np.nan)
+    forecast_timestamp = np.full(len(data_with_all_dates), np.datetime64('NaT'), dtype='datetime64[ns]')
+
+    # แบ่งข้อมูลตามสัปดาห์และเดือนครั้งเดียว แทนการกรองทั้ง DataFrame ซ้ำในทุกรอบของลูป
+    empty_data = data_not_missing.iloc[0:0]
+    missing_by_week = dict(list(data_missing.groupby('week_idx', sort=False)))
+    missing_counts = data_missing.groupby('week_idx', sort=False).size()
+    not_missing_by_week = dict(list(data_not_missing.groupby('week_idx', sort=False)))
+    not_missing_by_month = dict(list(data_not_missing.groupby('month', sort=False)))
+    clean_by_month = dict(list(data_clean.dropna(subset=['wl_up']).groupby('month', sort=False)))
+
     # Separate weeks with fewer and more missing rows
     weeks_with_fewer_missing = []
     weeks_with_more_missing = []
 
-    weeks_with_missing = data_missing['week_of_year'].unique()
+    weeks_with_missing = list(missing_by_week)
 
-    for week in weeks_with_missing:
-        group = data_missing[data_missing['week_of_year'] == week]
-        missing_count = group['wl_up'].isnull().sum()
+    for week, missing_count in missing_counts.items():
         if missing_count <= 288:
             weeks_with_fewer_missing.append(week)
         else:
             weeks_with_more_missing.append(week)
 
-    # Handle weeks with fewer than 288 missing rows by predicting missing values row-by-row
-    for week in weeks_with_fewer_missing:
-        group = data_missing[data_missing['week_of_year'] == week]
-        week_data = data_not_missing[data_not_missing['week_of_year'] == week]
-
-        if len(week_data) > 0:
-            X_train_week, y_train_week = prepare_features(week_data)
-            model_week = train_model(X_train_week, y_train_week)
-
-            for idx, row in group.iterrows():
-                X_missing = row[feature_cols].values.reshape(1, -1)
-                predicted_value = model_week.predict(X_missing)
-                
-                # บันทึกค่าที่เติมในคอลัมน์ wl_forecast และ timestamp
-                data_with_all_dates.loc[idx, 'wl_forecast'] = predicted_value
-                data_with_all_dates.loc[idx, 'timestamp'] = pd.Timestamp.now()
-
-    # Update data_not_missing after filling values
-    data_not_missing = data_with_all_dates.dropna(subset=['wl_up'])
+    # Handle weeks with fewer than 288 missing rows by time interpolation
+    # ช่องว่างสั้น ๆ เติมด้วยค่าข้างเคียงตามเวลาได้แม่นยำพอ ไม่จำเป็นต้องฝึกโมเดลใหม่ทุกสัปดาห์
+    if weeks_with_fewer_missing:
+        wl_up = data_with_all_dates['wl_up'].to_numpy(dtype=np.float64)
+        elapsed = data_with_all_dates.index.to_numpy(dtype='datetime64[ns]').view('i8')
+        known = ~np.isnan(wl_up)
+        interpolated = np.interp(elapsed, elapsed[known], wl_up[known])
+        fewer_missing_index = pd.concat([missing_by_week[week] for week in weeks_with_fewer_missing]).index
+        positions = data_with_all_dates.index.get_indexer(fewer_missing_index)
+        wl_forecast[positions] = interpolated[positions]
+        forecast_timestamp[positions] = pd.Timestamp.now().to_datetime64()
 
     # Handle weeks with more than 288 missing rows using data from adjacent weeks
+    gap_tasks = []
     for week in weeks_with_more_missing:
-        group = data_missing[data_missing['week_of_year'] == week]
+        group = missing_by_week[week]
         prev_week = week - 1 if week > min(weeks_with_missing) else week
         next_week = week + 1 if week < max(weeks_with_missing) else week
 
-        prev_data = data_not_missing[data_not_missing['week_of_year'] == prev_week]
-        next_data = data_not_missing[data_not_missing['week_of_year'] == next_week]
-        previous_month_data = data_not_missing[data_not_missing['month'] == group['month'].iloc[0] - 1]
+        prev_data = not_missing_by_week.get(prev_week, empty_data)
+        next_data = not_missing_by_week.get(next_week, empty_data)
+        previous_month_data = not_missing_by_month.get(group['month'].iloc[0] - 1, empty_data)
 
         combined_data = pd.concat([prev_data, next_data, previous_month_data])
 
-        if data_missing[data_missing['week_of_year'] == next_week]['wl_up'].isnull().sum() > 288:
+        if missing_counts.get(next_week, 0) > 288:
             current_month = group['month'].iloc[0]
-            non_missing_month_data = data_clean[(data_clean['month'] == current_month) & (~data_clean['wl_up'].isnull())]
-
-            X_train_month, y_train_month = prepare_features(non_missing_month_data)
-            model_month = train_model(X_train_month, y_train_month)
-
-            for idx, row in group.iterrows():
-                X_missing = row[feature_cols].values.reshape(1, -1)
-                predicted_value = model_month.predict(X_missing)
-
-                # บันทึกค่าที่เติมในคอลัมน์ wl_forecast และ timestamp
-                data_with_all_dates.loc[idx, 'wl_forecast'] = predicted_value
-                data_with_all_dates.loc[idx, 'timestamp'] = pd.Timestamp.now()
+            non_missing_month_data = clean_by_month.get(current_month, empty_data)
+            X_train_gap, y_train_gap = prepare_features(non_missing_month_data)
         else:
-            combined_train_X, combined_train_y = prepare_features(combined_data)
-            model_combined = train_model(combined_train_X, combined_train_y)
-
-            for idx, row in group.iterrows():
-                X_missing = row[feature_cols].values.reshape(1, -1)
-                predicted_value = model_combined.predict(X_missing)
-
-                # บันทึกค่าที่เติมในคอลัมน์ wl_forecast และ timestamp
-                data_with_all_dates.loc[idx, 'wl_forecast'] = predicted_value
-                data_with_all_dates.loc[idx, 'timestamp'] = pd.Timestamp.now()
+            X_train_gap, y_train_gap = prepare_features(combined_data)
+
+        gap_tasks.append((group.index, X_train_gap, y_train_gap, group[feature_cols]))
+
+    # แต่ละสัปดาห์เป็นอิสระต่อกัน จึงฝึกและพยากรณ์พร้อมกันด้วย thread (HistGradientBoosting ปล่อย GIL ระหว่างฝึก)
+    # ไม่ใช้ process pool เพราะต้อง pickle โมเดลและข้อมูลทุกงาน และการเปิด worker ใหม่ช้ากว่างานที่ทำเอง
+    # แบ่ง core ให้แต่ละ thread เท่า ๆ กัน: จำกัดจำนวน thread ของ OpenMP ในแต่ละโมเดลไม่ให้รวมกันเกินจำนวน core
+    n_workers = max(1, min(len(gap_tasks), cpu_count()))
+    with threadpool_limits(limits=max(1, cpu_count() // n_workers), user_api='openmp'):
+        gap_predictions = Parallel(n_jobs=n_workers, prefer='threads')(
+            delayed(predict_gap)(model, X_train_gap, y_train_gap, X_missing)
+            for _, X_train_gap, y_train_gap, X_missing in gap_tasks
+        )
+    for (gap_index, *_), predicted_values in zip(gap_tasks, gap_predictions):
+        # พยากรณ์ทุกแถวที่หายไปของกลุ่มนี้ในครั้งเดียว
+        positions = data_with_all_dates.index.get_indexer(gap_index)
+        wl_forecast[positions] = predicted_values
+        forecast_timestamp[positions] = pd.Timestamp.now().to_datetime64()
+
+    # บันทึกค่าที่เติมในคอลัมน์ wl_forecast และ timestamp
+    data_with_all_dates['wl_forecast'] = wl_forecast
+    data_with_all_dates['timestamp'] = forecast_timestamp
 
     # สร้างคอลัมน์ wl_up2 ที่รวมข้อมูลเดิมกับค่าที่เติม
     data_with_all_dates['wl_up2'] = data_with_all_dates['wl_up'].combine_first(data_with_all_dates['wl_forecast'])
@@ -210,14 +314,31 @@ def calculate_accuracy_metrics(original, filled):
     # ผสานข้อมูลโดยใช้ datetime เป็นพื้นฐาน โดยจะใช้ wl_up จาก original และ wl_up2 จาก filled
     merged_data = pd.merge(original[['datetime', 'wl_up']], filled[['datetime', 'wl_up2']], on='datetime')
     
-    # คำนวณค่าความแม่นยำจาก wl_up ของ original และ wl_up2 ของ filled
-    mse = mean_squared_error(merged_data['wl_up'], merged_data['wl_up2'])
-    mae = mean_absolute_error(merged_data['wl_up'], merged_data['wl_up2'])
-    r2 = r2_score(merged_data['wl_up'], merged_data['wl_up2'])
+    # คำนวณค่าความแม่นยำจาก wl_up ของ original และ wl_up2 ของ filled ด้วย numpy ในรอบเดียว
+    actual = merged_data['wl_up'].to_numpy(dtype=np.float64)
+    filled_values = merged_data['wl_up2'].to_numpy(dtype=np.float64)
+    valid = ~(np.isnan(actual) | np.isnan(filled_values))
+    actual, filled_values = actual[valid], filled_values[valid]
 
     # แสดงค่าความแม่นยำบนหน้าจอ
     st.header("ผลค่าความแม่นยำ", divider='gray')
 
+    if len(actual) == 0:
+        st.info("ไม่สามารถคำนวณความแม่นยำได้เนื่องจากไม่มีค่าจริงให้เปรียบเทียบ")
+        return
+
+    diff = actual - filled_values
+    mse = np.mean(diff * diff)
+    mae = np.mean(np.abs(diff))
+    centered = actual - actual.mean()
+    residual_sum = diff.dot(diff)
+    total_sum = centered.dot(centered)
+    if total_sum == 0:
+        # ค่าจริงคงที่ทั้งหมด: ใช้ค่าเดียวกับ r2_score (1.0 ถ้าทายถูกทุกค่า ไม่เช่นนั้น 0.0)
+        r2 = 1.0 if residual_sum == 0 else 0.0
+    else:
+        r2 = 1 - residual_sum / total_sum
+
     col1, col2, col3 = st.columns(3)
 
     with col1:
@@ -230,26 +351,17 @@ def calculate_accuracy_metrics(original, filled):
         st.metric(label="R-squared (R²)", value=f"{r2:.4f}")
 
 def plot_results(data_before, data_filled, data_deleted):
-    data_before_filled = pd.DataFrame({
-        'วันที่': data_before['datetime'],
-        'ข้อมูลเดิม': data_before['wl_up']
-    })
-
-    data_after_filled = pd.DataFrame({
-        'วันที่': data_filled['datetime'],
-        'ข้อมูลหลังเติมค่า': data_filled['wl_up2']
-    })
-
-    data_after_deleted = pd.DataFrame({
-        'วันที่': data_deleted['datetime'],
-        'ข้อมูลหลังลบ': data_deleted['wl_up']
-    })
-
-    combined_data = pd.merge(data_before_filled, data_after_filled, on='วันที่', how='outer')
-    combined_data = pd.merge(combined_data, data_after_deleted, on='วันที่', how='outer')
-
-    min_y = combined_data[['ข้อมูลเดิม', 'ข้อมูลหลังเติมค่า', 'ข้อมูลหลังลบ']].min().min()
-    max_y = combined_data[['ข้อมูลเดิม', 'ข้อมูลหลังเติมค่า', 'ข้อมูลหลังลบ']].max().max()
+    # รวมข้อมูลทั้งสามชุดโดยจัดแนวตาม datetime index แทนการ merge แบบ outer สองครั้ง
+    combined_data = pd.concat([
+        series_by_datetime(data_before, 'wl_up', 'ข้อมูลเดิม'),
+        series_by_datetime(data_filled, 'wl_up2', 'ข้อมูลหลังเติมค่า'),
+        series_by_datetime(data_deleted, 'wl_up', 'ข้อมูลหลังลบ')
+    ], axis=1)
+    combined_data = downsample_for_chart(combined_data).rename_axis('วันที่').reset_index()
+
+    values_y = combined_data[['ข้อมูลเดิม', 'ข้อมูลหลังเติมค่า', 'ข้อมูลหลังลบ']].to_numpy(dtype=np.float64)
+    min_y = np.nanmin(values_y)
+    max_y = np.nanmax(values_y)
 
     chart = alt.Chart(combined_data).transform_fold(
         ['ข้อมูลเดิม', 'ข้อมูลหลังเติมค่า', 'ข้อมูลหลังลบ'],
@@ -284,8 +396,9 @@ def plot_data_preview(data1, data2):
     })
 
     combined_data_pre = pd.merge(data_pre1, data_pre2, on='วันที่', how='outer')
-    min_y = combined_data_pre[['สถานีที่ต้องการเติมค่า', 'สถานีก่อนหน้า']].min().min()
-    max_y = combined_data_pre[['สถานีที่ต้องการเติมค่า', 'สถานีก่อนหน้า']].max().max()
+    values_y = combined_data_pre[['สถานีที่ต้องการเติมค่า', 'สถานีก่อนหน้า']].to_numpy(dtype=np.float64)
+    min_y = np.nanmin(values_y)
+    max_y = np.nanmax(values_y)
 
     chart = alt.Chart(combined_data_pre).transform_fold(
         ['สถานีที่ต้องการเติมค่า', 'สถานีก่อนหน้า'],
@@ -308,8 +421,8 @@ st.set_page_config(
     layout="wide"
 )
 '''
-# การจัดการข้อมูลระดับน้ำด้วย Random Forest
-แอป Streamlit สำหรับจัดการข้อมูลระดับน้ำ โดยใช้โมเดล Random Forest เพื่อเติมค่าที่ขาดหายไป 
+# การจัดการข้อมูลระดับน้ำด้วย Gradient Boosting
+แอป Streamlit สำหรับจัดการข้อมูลระดับน้ำ โดยใช้โมเดล Histogram Gradient Boosting เพื่อเติมค่าที่ขาดหายไป 
 ข้อมูลถูกประมวลผลและแสดงผลผ่านกราฟและการวัดค่าความแม่นยำ ผู้ใช้สามารถเลือกอัปโหลดไฟล์, 
 กำหนดช่วงเวลาลบข้อมูล, และดูผลลัพธ์ของการเติมค่าได้
 '''